@@ -1,26 +1,73 @@
 # fetch_ohlcv.py
 import os
+import json
 import time
+import atexit
 import logging
+import itertools
+import threading
+import numpy as np
 import pandas as pd
-import requests
-from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # stdlib fallback
+    from json import loads as json_loads
+
 # ==============================
 # ✅ CONFIG
 # ==============================
 SYMBOLS = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "BNBUSDT", "LTCUSDT", "QNTUSDT"]
 TIMEFRAMES = ["1m", "5m", "15m", "30m", "1h", "4h", "1d"]
 OUT_DIR = Path("data/ohlcv")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 BINANCE_API_URL = "https://data-api.binance.vision/api/v3/klines"
 BINANCE_MAX_LIMIT = 1000
 RETRY_LIMIT = 4
-REQUEST_SLEEP = 0.15
+MAX_WORKERS = 6  # concurrent (symbol, interval) jobs
+FETCH_WORKERS = 8  # concurrent kline window requests
+WEIGHT_LIMIT_1M = 1200  # Binance request weight budget per minute (per IP)
+KLINES_WEIGHT = 2
+WEIGHT_SOFT_LIMIT = 1000  # start slowing down once X-MBX-USED-WEIGHT-1M passes this
 INCREMENTAL_HOURS = 12  # periodic incremental fetch window
 
+PRICE_DTYPE = np.float32  # open/high/low/close on disk, only where it still round-trips to the tick
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+VOLUME_DTYPE = np.float64  # volume keeps full precision for dust-sized amounts
+
+# 📐 On-disk schema: symbol/interval are constant per file, so dictionary-encode them; Binance times are ms.
+# Prices are float64 here; _file_schema narrows them to PRICE_DTYPE per file when that is lossless.
+SCHEMA = pa.schema([
+    ("symbol", pa.dictionary(pa.int32(), pa.string())),
+    ("interval", pa.dictionary(pa.int32(), pa.string())),
+    ("open_time", pa.timestamp("ms")),
+    ("close_time", pa.timestamp("ms")),
+    ("open", pa.float64()),
+    ("high", pa.float64()),
+    ("low", pa.float64()),
+    ("close", pa.float64()),
+    ("volume", pa.from_numpy_dtype(VOLUME_DTYPE)),
+    ("num_trades", pa.int64()),
+])
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "4h": 14_400_000,
+    "1d": 86_400_000,
+}
+
 # 🧠 Dynamic backfill map (per interval)
 HISTORICAL_DEPTH = {
     "1m": timedelta(days=365 * 0.5),   # ~6 months
@@ -32,34 +79,128 @@ HISTORICAL_DEPTH = {
     "1d": timedelta(days=365 * 5),     # ~5 years
 }
 
+# 🔌 Shared HTTP/2 client: worker threads multiplex their requests over one keep-alive TLS connection
+CLIENT = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+    timeout=15,
+)
+atexit.register(CLIENT.close)
+
+
+# 🚦 Token bucket shared by all worker threads (refills WEIGHT_LIMIT_1M per minute)
+class RateLimiter:
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, weight=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.rate
+            time.sleep(wait)
+
+LIMITER = RateLimiter(WEIGHT_LIMIT_1M)
+
+# 📈 Server-side feedback: pause all threads based on the weight Binance reports as used
+class AdaptiveLimiter:
+    def __init__(self, soft_limit=WEIGHT_SOFT_LIMIT, step=200):
+        self.soft_limit = soft_limit
+        self.step = step
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while (delay := self.resume_at - time.monotonic()) > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def update(self, headers):
+        # a missing or malformed header must not turn a good response into a retry
+        try:
+            used = int(headers.get("X-MBX-USED-WEIGHT-1M", "0"))
+        except (TypeError, ValueError):
+            used = 0
+        if used > self.soft_limit:
+            self.pause((used - self.soft_limit) / self.step)
+
+ADAPTIVE = AdaptiveLimiter()
+
+# 🔒 One lock per output file so concurrent jobs only serialize on the same path
+_PATH_LOCKS = {}
+_PATH_LOCKS_GUARD = threading.Lock()
+
+def _path_lock(path):
+    with _PATH_LOCKS_GUARD:
+        return _PATH_LOCKS.setdefault(path, threading.Lock())
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
+logging.getLogger("httpx").setLevel(logging.WARNING)  # httpx logs every request at INFO
+LOG = logging.getLogger(__name__)
 
 # ==============================
 # ✅ FETCH FROM BINANCE
 # ==============================
-def fetch_klines(symbol, interval, start_ts=None, end_ts=None, limit=BINANCE_MAX_LIMIT):
+def _retry_after_seconds(headers, default=60):
+    # Retry-After is either delta-seconds or an HTTP-date; anything unparsable waits `default`
+    value = headers.get("Retry-After")
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+def fetch_klines(symbol, interval, start_ms=None, end_ms=None, limit=BINANCE_MAX_LIMIT):
+    # start_ms/end_ms: epoch milliseconds, computed once by the caller
     params = {"symbol": symbol, "interval": interval, "limit": limit}
-    if start_ts:
-        params["startTime"] = int(start_ts.timestamp() * 1000)
-    if end_ts:
-        params["endTime"] = int(end_ts.timestamp() * 1000)
+    if start_ms is not None:
+        params["startTime"] = start_ms
+    if end_ms is not None:
+        params["endTime"] = end_ms
 
     for attempt in range(1, RETRY_LIMIT + 1):
+        LIMITER.acquire(KLINES_WEIGHT)
+        ADAPTIVE.wait()
         try:
-            r = requests.get(BINANCE_API_URL, params=params, timeout=15)
+            r = CLIENT.get(BINANCE_API_URL, params=params)
+            ADAPTIVE.update(r.headers)
+            if r.status_code in (418, 429):
+                # rate limited / banned: every thread backs off for as long as Binance asks
+                retry_after = _retry_after_seconds(r.headers)
+                LOG.warning("[%s-%s] HTTP %s, backing off %ss (%s/%s)", symbol, interval, r.status_code, retry_after, attempt, RETRY_LIMIT)
+                ADAPTIVE.pause(retry_after)
+                continue
             r.raise_for_status()
-            data = r.json()
-            if isinstance(data, dict) and "code" in data:
-                raise Exception(data.get("msg", "API error"))
-            return data
+            data = json_loads(r.content)
         except Exception as e:
-            logging.warning(f"[{symbol}-{interval}] Retry {attempt}/{RETRY_LIMIT} failed: {e}")
+            LOG.warning("[%s-%s] Retry %s/%s failed: %s", symbol, interval, attempt, RETRY_LIMIT, e)
             time.sleep(attempt * 1.5)
-    logging.error(f"[{symbol}-{interval}] Failed after {RETRY_LIMIT} retries.")
-    return []
+            continue
+        if isinstance(data, dict) and "code" in data:
+            # 2xx with an API error body: nothing transient to wait out
+            LOG.warning("[%s-%s] Retry %s/%s failed: %s", symbol, interval, attempt, RETRY_LIMIT, data.get("msg", "API error"))
+            continue
+        return data
+    LOG.error("[%s-%s] Failed after %s retries.", symbol, interval, RETRY_LIMIT)
+    return None
 
 # ==============================
 # ✅ TO DATAFRAME
@@ -67,39 +208,116 @@ def fetch_klines(symbol, interval, start_ts=None, end_ts=None, limit=BINANCE_MAX
 def to_df(klines, symbol, interval):
     if not klines:
         return pd.DataFrame()
-    df = pd.DataFrame(
-        klines,
-        columns=[
-            "open_time", "open", "high", "low", "close", "volume",
-            "close_time", "quote_asset_volume", "num_trades",
-            "taker_buy_base", "taker_buy_quote", "ignore"
-        ]
-    )
-    df["symbol"] = symbol
-    df["interval"] = interval
-    df["open_time"] = pd.to_datetime(df["open_time"], unit="ms")
-    df["close_time"] = pd.to_datetime(df["close_time"], unit="ms")
-    df[["open", "high", "low", "close", "volume"]] = df[["open", "high", "low", "close", "volume"]].astype(float)
-    df["num_trades"] = df["num_trades"].astype(int)
-    return df[["symbol", "interval", "open_time", "close_time", "open", "high", "low", "close", "volume", "num_trades"]]
+    # one object array, then column-wise casts: skips per-cell type inference and the astype round-trip
+    a = np.asarray(klines, dtype=object)
+    prices = a[:, 1:5].astype(np.float64)  # narrowed (if at all) per file in save_parquet
+    open_time = pd.to_datetime(a[:, 0].astype(np.int64), unit="ms")
+    # bars are fixed-width: close_time is always open_time + interval - 1ms
+    close_time = open_time + pd.Timedelta(milliseconds=INTERVAL_MS[interval] - 1)
+    return pd.DataFrame({
+        "symbol": symbol,
+        "interval": interval,
+        "open_time": open_time,
+        "close_time": close_time,
+        "open": prices[:, 0],
+        "high": prices[:, 1],
+        "low": prices[:, 2],
+        "close": prices[:, 3],
+        "volume": a[:, 5].astype(VOLUME_DTYPE),
+        "num_trades": pd.array(a[:, 8].astype(np.int64), dtype="int64[pyarrow]"),
+    }).convert_dtypes(dtype_backend="pyarrow", convert_integer=False)  # keep whole-number prices as floats
 
 # ==============================
 # ✅ MERGE + SAVE
 # ==============================
+def _tick_decimals(prices, stored_dtype=np.float64):
+    # Binance quotes prices as decimals with up to 8 places: the fewest decimals that reproduce every
+    # stored value is the tick the data actually uses
+    stored = prices.astype(stored_dtype)
+    for decimals in range(9):
+        if np.array_equal(np.round(prices, decimals).astype(stored_dtype), stored):
+            return decimals
+    return 8
+
+def _tick_exact(prices, dtype):
+    # (exact, decimals): does every price still round back to its tick after a round-trip through dtype
+    decimals = _tick_decimals(prices)
+    narrowed = prices.astype(dtype).astype(np.float64)
+    return np.array_equal(np.round(narrowed, decimals), prices), decimals
+
+def _snap_to_tick(table, decimals):
+    # float32 history widened to float64: round the upcast noise (3.3 -> 3.299999952) back to its tick
+    prices = np.column_stack([table[c].to_numpy() for c in PRICE_COLUMNS])
+    decimals = max(decimals, _tick_decimals(prices, PRICE_DTYPE))
+    for c in PRICE_COLUMNS:
+        i = table.schema.get_field_index(c)
+        table = table.set_column(i, table.schema.field(i), pa.array(np.round(table[c].to_numpy(), decimals)))
+    return table
+
+def _file_schema(path, df):
+    # (schema, tick decimals of the new rows). Never narrow stored history: a file whose prices are
+    # already wider than PRICE_DTYPE stays wide, and new rows that would lose their tick in
+    # PRICE_DTYPE widen the file to float64
+    narrow = pa.from_numpy_dtype(PRICE_DTYPE)
+    exact, decimals = _tick_exact(df[PRICE_COLUMNS].to_numpy(dtype=np.float64), PRICE_DTYPE)
+    if not exact or (path.exists() and pq.read_schema(path).field("open").type != narrow):
+        return SCHEMA, decimals
+    return pa.schema([pa.field(f.name, narrow) if f.name in PRICE_COLUMNS else f for f in SCHEMA]), decimals
+
 def save_parquet(df, symbol, interval):
     path = OUT_DIR / f"{symbol}_{interval}.parquet"
-    if path.exists():
-        old = pd.read_parquet(path)
-        combined = pd.concat([old, df], ignore_index=True)
-        combined = combined.drop_duplicates(subset=["symbol", "interval", "open_time"]).sort_values("open_time")
-    else:
-        combined = df
-    combined.to_parquet(path, index=False)
-    logging.info(f"💾 {symbol}-{interval}: saved {len(combined)} total rows")
+    with _path_lock(path):
+        schema, decimals = _file_schema(path, df)
+        new = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        head, overlap = new.slice(0, 0), []
+        if path.exists():
+            with pq.ParquetFile(path) as pf:
+                old = pf.read()
+            widened = old.schema.field("open").type != schema.field("open").type
+            old = old.cast(schema)
+            if widened:
+                old = _snap_to_tick(old, decimals)
+            # history is already sorted and deduplicated: only rows overlapping the new window need merging
+            in_overlap = pc.greater_equal(old["open_time"], pc.min(new["open_time"]))
+            head, overlap = old.filter(pc.invert(in_overlap)), [old.filter(in_overlap)]
+        # arrow concat only references the chunks; one to_pandas for the (small) tail
+        tail = pa.concat_tables([*overlap, new]).to_pandas()
+        # one file holds a single symbol/interval, so open_time alone identifies a bar
+        tail = tail[~tail["open_time"].duplicated()]
+        # old rows + new rows are two sorted runs: a stable mergesort just merges them
+        tail = tail.sort_values("open_time", kind="mergesort", ignore_index=True)
+        combined = pa.concat_tables([head, pa.Table.from_pandas(tail, schema=schema, preserve_index=False)])
+
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            pq.write_table(combined, tmp, compression="zstd", use_dictionary=True)
+            os.replace(tmp, path)
+        except BaseException:
+            # never leave a half-written .tmp behind for `git add data/` to pick up
+            tmp.unlink(missing_ok=True)
+            raise
+        # sidecar with the last bar so determine_fetch_range needn't load the parquet
+        last_open_ms = int(tail["open_time"].max().value // 1_000_000)
+        path.with_suffix(".meta.json").write_text(json.dumps({"last_open_ms": last_open_ms}))
+    LOG.info("💾 %s-%s: saved %s total rows", symbol, interval, combined.num_rows)
 
 # ==============================
 # ✅ DETERMINE FETCH MODE
 # ==============================
+def _last_open_time(path):
+    meta_path = path.with_suffix(".meta.json")
+    try:
+        return pd.Timestamp(json_loads(meta_path.read_bytes())["last_open_ms"], unit="ms")
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # missing or unreadable sidecar: fall back to parquet row-group statistics
+
+    meta = pq.read_metadata(path)
+    col = meta.schema.names.index("open_time")
+    stats = [meta.row_group(i).column(col).statistics for i in range(meta.num_row_groups)]
+    if stats and all(st is not None and st.has_min_max for st in stats):
+        return pd.Timestamp(max(st.max for st in stats))
+    return pd.read_parquet(path, columns=["open_time"])["open_time"].max()
+
 def determine_fetch_range(symbol, interval):
     path = OUT_DIR / f"{symbol}_{interval}.parquet"
     now = datetime.utcnow()
@@ -107,49 +325,54 @@ def determine_fetch_range(symbol, interval):
     if not path.exists():
         # 🔹 Historical backfill (first time)
         backfill_start = now - HISTORICAL_DEPTH.get(interval, timedelta(days=365))
-        logging.info(f"🕰️ {symbol}-{interval}: Performing historical backfill ({backfill_start.date()} → {now.date()})")
+        LOG.info("🕰️ %s-%s: Performing historical backfill (%s → %s)", symbol, interval, backfill_start.date(), now.date())
         return backfill_start, now
     else:
         # 🔹 Incremental mode (subsequent 12-hour updates)
-        df = pd.read_parquet(path)
-        last_ts = df["open_time"].max()
+        last_ts = _last_open_time(path)
         start_time = last_ts + timedelta(milliseconds=1)
         if (now - start_time) < timedelta(hours=INCREMENTAL_HOURS):
-            logging.info(f"✅ {symbol}-{interval}: Already up to date (last={last_ts})")
+            LOG.info("✅ %s-%s: Already up to date (last=%s)", symbol, interval, last_ts)
             return None, None
-        logging.info(f"⏩ {symbol}-{interval}: Incremental fetch from {start_time} to {now}")
+        LOG.info("⏩ %s-%s: Incremental fetch from %s to %s", symbol, interval, start_time, now)
         return start_time, now
 
 # ==============================
 # ✅ FETCH LOOP
 # ==============================
-def run_fetch():
-    for sym in SYMBOLS:
-        for interval in TIMEFRAMES:
-            start_time, end_time = determine_fetch_range(sym, interval)
-            if not start_time or not end_time:
-                continue
+def _fetch_one(sym, interval, fetch_pool):
+    start_time, end_time = determine_fetch_range(sym, interval)
+    if not start_time or not end_time:
+        return
+
+    # Bars are fixed-width, so split the range upfront into windows of at most
+    # BINANCE_MAX_LIMIT bars and fetch them in parallel instead of cursor chasing.
+    span = INTERVAL_MS[interval] * BINANCE_MAX_LIMIT
+    start_ms, end_ms = int(start_time.timestamp() * 1000), int(end_time.timestamp() * 1000)
+    windows = [(ms, min(ms + span - 1, end_ms)) for ms in range(start_ms, end_ms, span)]
+    results = list(fetch_pool.map(lambda w: fetch_klines(sym, interval, *w), windows))
 
-            all_dfs = []
-            current = start_time
-            while current < end_time:
-                klines = fetch_klines(sym, interval, current, end_time)
-                if not klines:
-                    break
-                df = to_df(klines, sym, interval)
-                if df.empty:
-                    break
-                all_dfs.append(df)
-                last_open = df["open_time"].iloc[-1]
-                current = last_open + timedelta(milliseconds=1)
-                time.sleep(REQUEST_SLEEP)
-
-            if all_dfs:
-                full = pd.concat(all_dfs, ignore_index=True)
-                save_parquet(full, sym, interval)
-            else:
-                logging.info(f"⚙️ No new data fetched for {sym}-{interval}")
-            time.sleep(0.5)
+    # collect raw rows and build a single DataFrame at the end
+    all_rows = []
+    for (w_start, _), klines in zip(windows, results):
+        if klines is None:
+            # keep data contiguous: the next run resumes from the last saved bar
+            LOG.warning("⚠️ %s-%s: window at %s failed, keeping earlier windows only", sym, interval, pd.Timestamp(w_start, unit="ms"))
+            break
+        all_rows.extend(klines)
+
+    if all_rows:
+        save_parquet(to_df(all_rows, sym, interval), sym, interval)
+    else:
+        LOG.info("⚙️ No new data fetched for %s-%s", sym, interval)
+
+def run_fetch():
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    # I/O bound: overlap network latency across jobs; LIMITER keeps us under the API weight budget.
+    # Windows go to a separate pool so jobs never block waiting on their own workers.
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetch_pool, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        list(ex.map(lambda job: _fetch_one(*job, fetch_pool), itertools.product(SYMBOLS, TIMEFRAMES)))
 
 if __name__ == "__main__":
     run_fetch()
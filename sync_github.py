@@ -1,17 +1,25 @@
 # sync_github.py
 import os
+import fnmatch
 import subprocess
 from datetime import datetime
 
+try:
+    import pygit2
+except ImportError:  # fall back to the git CLI
+    pygit2 = None
+
 GIT_REMOTE = "https://github.com/gokulmuthuR/crypto-ml-pipeline.git"
 BRANCH = "main"
 
 # Folders to keep locally (excluded from clean)
 EXCLUDED = ["models", "logs", "tmp", "data/tmp"]
 
-def run(cmd, check=True, safe=False):
+def run(argv, check=True, safe=False):
+    # argv list, no shell: one fork+exec per command and no quoting/injection issues
+    cmd = " ".join(argv)
     print(f"→ {cmd}")
-    res = subprocess.run(cmd, shell=True)
+    res = subprocess.run(argv)
     if check and res.returncode != 0:
         if safe:
             print(f"⚠️ (safe) command failed: {cmd}")
@@ -22,11 +30,82 @@ def run(cmd, check=True, safe=False):
 def ensure_repo():
     if not os.path.exists(".git"):
         print("🧩 Initializing git and setting remote...")
-        run("git init")
-        run(f"git remote add origin {GIT_REMOTE}", safe=True)
+        run(["git", "init"])
+        run(["git", "remote", "add", "origin", GIT_REMOTE], safe=True)
         # ensure branch exists locally (safe)
-        run(f"git fetch origin {BRANCH}", safe=True)
-        run(f"git checkout -b {BRANCH} || git checkout {BRANCH}", safe=True)
+        run(["git", "fetch", "origin", BRANCH], safe=True)
+        if run(["git", "checkout", "-b", BRANCH], check=False) != 0:
+            run(["git", "checkout", BRANCH], safe=True)
+
+def is_excluded(path):
+    # same matching as `git clean -e`: patterns without a slash match any path component,
+    # patterns containing one are anchored at the repo root
+    parts = path.split("/")
+    for pattern in EXCLUDED:
+        if "/" in pattern:
+            depth = pattern.count("/") + 1
+            if len(parts) >= depth and fnmatch.fnmatchcase("/".join(parts[:depth]), pattern):
+                return True
+        elif any(fnmatch.fnmatchcase(part, pattern) for part in parts):
+            return True
+    return False
+
+def in_nested_repo(path):
+    # git clean leaves untracked nested repositories alone unless given -ff
+    parts = path.split("/")
+    return any(os.path.exists(os.path.join(*parts[:i], ".git")) for i in range(1, len(parts) + 1))
+
+def clean_candidates(status):
+    # files `git clean -fdx -e <EXCLUDED>` would delete, from a pygit2 status dict
+    paths = []
+    for path, flags in status.items():
+        if not flags & (pygit2.GIT_STATUS_WT_NEW | pygit2.GIT_STATUS_IGNORED):
+            continue
+        path = path.rstrip("/")
+        if is_excluded(path) or in_nested_repo(path):
+            continue
+        if not os.path.isdir(path) or os.path.islink(path):
+            paths.append(path)
+            continue
+        # untracked/ignored directory reported as a whole: descend so exclusions and nested repos still apply
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [
+                d for d in dirs
+                if not is_excluded(f"{root}/{d}") and not os.path.exists(os.path.join(root, d, ".git"))
+            ]
+            paths.extend(f"{root}/{f}" for f in files if not is_excluded(f"{root}/{f}"))
+    return paths
+
+def fetch_reset_clean():
+    # fetch + hard reset + clean through one libgit2 handle, no git subprocesses
+    try:
+        repo = pygit2.Repository(".")
+        print(f"→ (pygit2) fetch origin {BRANCH}")
+        repo.remotes["origin"].fetch([f"+refs/heads/{BRANCH}:refs/remotes/origin/{BRANCH}"])
+        ref = repo.lookup_reference(f"refs/remotes/origin/{BRANCH}")
+        print(f"→ (pygit2) reset --hard origin/{BRANCH}")
+        repo.reset(ref.target, pygit2.GIT_RESET_HARD)
+        status = repo.status(untracked_files="all", ignored=True)
+    except (pygit2.GitError, KeyError) as e:
+        raise SystemExit(f"pygit2 sync failed: {e}")
+
+    # equivalent of `git clean -fdx -e <EXCLUDED>`: drop untracked + ignored files
+    print("→ (pygit2) clean untracked files")
+    parents = set()
+    for path in clean_candidates(status):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"⚠️ (safe) could not remove {path}: {e}")
+        parent = os.path.dirname(path)
+        while parent:
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+
+    # drop directories emptied above, deepest first (tracked directories always contain files)
+    for d in sorted(parents, key=len, reverse=True):
+        if os.path.isdir(d) and not os.listdir(d):
+            os.rmdir(d)
 
 def protect_local_files():
     # no-op for files; for directories we will exclude during clean using -e
@@ -39,23 +118,25 @@ def sync():
     # mark local config files as unchanged so reset won't alter them (if desired)
     # If you want to protect other individual files, add them here (optional)
     local_protect_files = [".replit", "requirements.txt", "README.md"]
-    for f in local_protect_files:
-        if os.path.exists(f):
-            run(f"git update-index --assume-unchanged {f}", check=False, safe=True)
+    protected = [f for f in local_protect_files if os.path.exists(f)]
+    if protected:
+        run(["git", "update-index", "--assume-unchanged", *protected], check=False, safe=True)
 
-    # fetch and reset
-    run(f"git fetch origin {BRANCH}")
-    run(f"git reset --hard origin/{BRANCH}")
+    if pygit2 is not None:
+        fetch_reset_clean()
+    else:
+        # fetch and reset
+        run(["git", "fetch", "origin", BRANCH])
+        run(["git", "reset", "--hard", f"origin/{BRANCH}"])
 
-    # git clean: remove untracked files except EXCLUDED
-    # build -e arguments
-    exclude_args = " ".join([f"-e {d}" for d in EXCLUDED])
-    run(f"git clean -fdx {exclude_args}", safe=True)
+        # git clean: remove untracked files except EXCLUDED
+        # build -e arguments
+        exclude_args = [arg for d in EXCLUDED for arg in ("-e", d)]
+        run(["git", "clean", "-fdx", *exclude_args], safe=True)
 
     # restore index flags on protected files
-    for f in local_protect_files:
-        if os.path.exists(f):
-            run(f"git update-index --no-assume-unchanged {f}", check=False, safe=True)
+    if protected:
+        run(["git", "update-index", "--no-assume-unchanged", *protected], check=False, safe=True)
 
     # write last_sync.log for monitoring
     with open("last_sync.log", "w") as fh:
@@ -0,0 +1,216 @@
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import fetch_ohlcv  # noqa: E402
+
+HOUR_MS = 3_600_000
+START_MS = 1_700_000_000_000 // HOUR_MS * HOUR_MS
+
+
+@pytest.fixture(autouse=True)
+def out_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_ohlcv, "OUT_DIR", tmp_path)
+    return tmp_path
+
+
+def klines(first_bar, n, price="100.25", step=HOUR_MS):
+    # raw Binance kline rows for bars first_bar .. first_bar + n - 1
+    return [
+        [START_MS + (first_bar + i) * step, price, price, price, price, "1.5",
+         START_MS + (first_bar + i + 1) * step - 1, "0", 7, "0", "0", "0"]
+        for i in range(n)
+    ]
+
+
+def write_baseline(path, n, row_group_size=None, price=100.25):
+    # the format committed before this series: string symbol/interval, ns timestamps, float64
+    open_time = pd.to_datetime(START_MS + np.arange(n, dtype=np.int64) * HOUR_MS, unit="ms").astype("datetime64[ns]")
+    df = pd.DataFrame({
+        "symbol": pd.Series(["BTCUSDT"] * n, dtype=object),
+        "interval": pd.Series(["1h"] * n, dtype=object),
+        "open_time": open_time,
+        "close_time": open_time + pd.Timedelta(milliseconds=HOUR_MS - 1),
+        "open": price, "high": price, "low": price, "close": price,
+        "volume": 1.5,
+        "num_trades": np.full(n, 7, dtype=np.int64),
+    })
+    table = pa.Table.from_pandas(df, preserve_index=False).cast(pa.schema([
+        ("symbol", pa.string()), ("interval", pa.string()),
+        ("open_time", pa.timestamp("ns")), ("close_time", pa.timestamp("ns")),
+        ("open", pa.float64()), ("high", pa.float64()), ("low", pa.float64()), ("close", pa.float64()),
+        ("volume", pa.float64()), ("num_trades", pa.int64()),
+    ]))
+    pq.write_table(table, path, row_group_size=row_group_size)
+    return pd.read_parquet(path)
+
+
+def save(rows):
+    fetch_ohlcv.save_parquet(fetch_ohlcv.to_df(rows, "BTCUSDT", "1h"), "BTCUSDT", "1h")
+    return pd.read_parquet(fetch_ohlcv.OUT_DIR / "BTCUSDT_1h.parquet")
+
+
+def assert_history_kept(saved, old):
+    cols = ["open", "high", "low", "close", "volume", "num_trades"]
+    assert np.array_equal(saved[cols].to_numpy()[:len(old)], old[cols].to_numpy())
+    assert (saved["open_time"].iloc[:len(old)].to_numpy() == old["open_time"].to_numpy()).all()
+
+
+def assert_sorted_unique(saved):
+    assert saved["open_time"].is_monotonic_increasing
+    assert saved["open_time"].is_unique
+
+
+def test_first_save_converts_baseline_format(out_dir):
+    path = out_dir / "BTCUSDT_1h.parquet"
+    old = write_baseline(path, 100)
+
+    saved = save(klines(100, 10))
+
+    schema = pq.read_schema(path)
+    assert schema.field("symbol").type == pa.dictionary(pa.int32(), pa.string())
+    assert schema.field("open_time").type == pa.timestamp("ms")
+    assert schema.field("open").type == pa.float64()  # float64 history is never narrowed
+    assert len(saved) == 110
+    assert_sorted_unique(saved)
+    assert_history_kept(saved, old)
+    meta = json.loads(path.with_suffix(".meta.json").read_text())
+    assert meta["last_open_ms"] == START_MS + 109 * HOUR_MS
+
+
+def test_overlapping_save_keeps_old_rows(out_dir):
+    old = write_baseline(out_dir / "BTCUSDT_1h.parquet", 100)
+
+    saved = save(klines(95, 10, price="999.5"))
+
+    assert len(saved) == 105
+    assert_sorted_unique(saved)
+    assert_history_kept(saved, old)
+    assert (saved["close"].iloc[95:100] == 100.25).all()
+    assert (saved["close"].iloc[100:] == 999.5).all()
+
+
+def test_save_starting_before_last_row_group(out_dir):
+    path = out_dir / "BTCUSDT_1h.parquet"
+    old = write_baseline(path, 100, row_group_size=30)
+    assert pq.ParquetFile(path).num_row_groups == 4
+
+    saved = save(klines(40, 70, price="999.5"))
+
+    assert len(saved) == 110
+    assert_sorted_unique(saved)
+    assert_history_kept(saved, old)
+    assert (saved["close"].iloc[100:] == 999.5).all()
+
+
+def test_failed_save_removes_tmp(out_dir, monkeypatch):
+    path = out_dir / "BTCUSDT_1h.parquet"
+    write_baseline(path, 100)
+    before = path.read_bytes()
+
+    def fail_midway(table, where, **kwargs):
+        Path(where).write_bytes(b"partial")
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(fetch_ohlcv.pq, "write_table", fail_midway)
+    with pytest.raises(RuntimeError):
+        fetch_ohlcv.save_parquet(fetch_ohlcv.to_df(klines(100, 10), "BTCUSDT", "1h"), "BTCUSDT", "1h")
+
+    assert sorted(p.name for p in out_dir.iterdir()) == ["BTCUSDT_1h.parquet"]
+    assert path.read_bytes() == before
+
+
+def test_tick_decimals_inferred_from_prices():
+    assert fetch_ohlcv._tick_decimals(np.array([3.3, 2500.12, 7.0])) == 2
+    assert fetch_ohlcv._tick_decimals(np.array([64000.0, 65000.0])) == 0
+    assert fetch_ohlcv._tick_exact(np.array([0.00012345]), np.float32) == (True, 8)
+
+
+def test_tick_exact_at_float32_spacing_boundary():
+    # below 2**17 float32 spacing (0.0078) still resolves a 0.01 tick; above it (0.0156) it does not
+    assert fetch_ohlcv._tick_exact(np.array([131071.99]), np.float32) == (True, 2)
+    assert fetch_ohlcv._tick_exact(np.array([131072.01]), np.float32) == (False, 2)
+
+
+def test_price_dtype_follows_first_batch():
+    path = fetch_ohlcv.OUT_DIR / "BTCUSDT_1h.parquet"
+    save(klines(0, 5, price="131072.01"))
+    assert pq.read_schema(path).field("close").type == pa.float64()
+
+
+def test_widening_float32_file_rounds_history_to_tick():
+    path = fetch_ohlcv.OUT_DIR / "BTCUSDT_1h.parquet"
+    save(klines(0, 5, price="3.3"))
+    assert pq.read_schema(path).field("close").type == pa.float32()
+
+    saved = save(klines(5, 5, price="200000.01"))
+
+    assert pq.read_schema(path).field("close").type == pa.float64()
+    assert saved["close"].tolist() == [3.3] * 5 + [200000.01] * 5
+    assert saved["open"].tolist() == [3.3] * 5 + [200000.01] * 5
+
+
+def test_bad_weight_header_does_not_discard_response(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=klines(0, 2), headers={"X-MBX-USED-WEIGHT-1M": "abc"})
+
+    monkeypatch.setattr(fetch_ohlcv, "CLIENT", httpx.Client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(fetch_ohlcv, "ADAPTIVE", fetch_ohlcv.AdaptiveLimiter())
+
+    assert fetch_ohlcv.fetch_klines("BTCUSDT", "1h", START_MS, START_MS + HOUR_MS) == klines(0, 2)
+    assert len(calls) == 1
+
+
+def test_fetch_one_splits_range_into_windows(monkeypatch):
+    # 4.5 windows of 1h bars; the symbol lists at bar 1200 and the window at bar 3000 keeps failing
+    listing_ms, failing_ms = START_MS + 1200 * HOUR_MS, START_MS + 3000 * HOUR_MS
+    end_ms = START_MS + 4500 * HOUR_MS + 123
+    requested = []
+
+    def handler(request):
+        start, end = int(request.url.params["startTime"]), int(request.url.params["endTime"])
+        requested.append((start, end))
+        if start == failing_ms:
+            return httpx.Response(500)
+        first = max(start, listing_ms)
+        first_bar = -(-(first - START_MS) // HOUR_MS)
+        last_bar = (end - START_MS) // HOUR_MS
+        return httpx.Response(200, json=klines(first_bar, max(0, last_bar - first_bar + 1)))
+
+    as_dt = lambda ms: datetime.fromtimestamp(ms / 1000, tz=timezone.utc)  # noqa: E731
+    monkeypatch.setattr(fetch_ohlcv, "determine_fetch_range", lambda s, i: (as_dt(START_MS), as_dt(end_ms)))
+    monkeypatch.setattr(fetch_ohlcv, "CLIENT", httpx.Client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(fetch_ohlcv, "LIMITER", fetch_ohlcv.RateLimiter(10_000))
+    monkeypatch.setattr(fetch_ohlcv, "ADAPTIVE", fetch_ohlcv.AdaptiveLimiter())
+    monkeypatch.setattr(fetch_ohlcv.time, "sleep", lambda s: None)
+
+    with ThreadPoolExecutor(4) as pool:
+        fetch_ohlcv._fetch_one("BTCUSDT", "1h", pool)
+
+    # windows tile [START_MS, end_ms] without gaps or overlap, each at most BINANCE_MAX_LIMIT bars
+    windows = sorted(set(requested))
+    assert windows[0][0] == START_MS and windows[-1][1] == end_ms
+    assert all(b[0] == a[1] + 1 for a, b in zip(windows, windows[1:]))
+    assert all(e - s < fetch_ohlcv.BINANCE_MAX_LIMIT * HOUR_MS for s, e in windows)
+    assert len(windows) == 5
+
+    # the empty pre-listing window is kept going; everything from the failed window on is dropped
+    saved = pd.read_parquet(fetch_ohlcv.OUT_DIR / "BTCUSDT_1h.parquet")
+    assert_sorted_unique(saved)
+    open_ms = saved["open_time"].to_numpy().astype("datetime64[ms]").astype(np.int64)
+    assert open_ms[0] == listing_ms
+    assert open_ms[-1] == failing_ms - HOUR_MS
+    assert (np.diff(open_ms) == HOUR_MS).all()
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import sync_github  # noqa: E402
+
+pygit2 = pytest.importorskip("pygit2")
+
+
+def git(*args):
+    return subprocess.run(["git", *args], check=True, capture_output=True, text=True).stdout
+
+
+def touch(path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text("x")
+
+
+def git_clean_dry_run():
+    # files the CLI fallback would delete, with whole-directory entries expanded
+    exclude_args = [arg for d in sync_github.EXCLUDED for arg in ("-e", d)]
+    removed = set()
+    for line in git("clean", "-n", "-dx", *exclude_args).splitlines():
+        if not line.startswith("Would remove "):
+            continue
+        path = line[len("Would remove "):]
+        if path.endswith("/"):
+            for root, _, files in os.walk(path.rstrip("/")):
+                removed.update(f"{root}/{f}" for f in files)
+        else:
+            removed.add(path)
+    return removed
+
+
+def test_clean_candidates_match_git_clean(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    git("init", "-q")
+    touch(".gitignore")
+    Path(".gitignore").write_text("build/\n*.log\n")
+    touch("tracked/file.txt")
+    git("add", ".")
+    git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init")
+
+    for path in [
+        "new.txt",
+        "tracked/new.txt",
+        "untracked/a.txt",
+        "untracked/deep/b.txt",
+        "sub/models/keep",       # slash-less pattern: excluded at any depth
+        "models/m.bin",
+        "logs/run.txt",
+        "data/tmp/t.parquet",
+        "x/data/tmp/t.parquet",  # `tmp` also matches below the root
+        "build/out.o",           # ignored directory
+        "build/tmp/cache",
+        "debug.log",             # ignored file
+    ]:
+        touch(path)
+    touch("vendor/lib/src.py")  # untracked nested repository: needs -ff to remove
+    git("-C", "vendor/lib", "init", "-q")
+
+    status = pygit2.Repository(".").status(untracked_files="all", ignored=True)
+    assert set(sync_github.clean_candidates(status)) == git_clean_dry_run()